@@ -21,10 +21,10 @@
 # OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
 # SOFTWARE.
 #
-import itertools
+import functools
 import pathlib
+import sys
 
-import dendropy
 import msprime
 import numpy as np
 import pytest
@@ -33,6 +33,64 @@ import tskit
 import tsconvert
 
 
+def kc_fill(m_row, tree, k):
+    """
+    Writes the depth of the MRCA of each pair of samples in the specified tree
+    into m_row, working directly on the tree's parent array.
+    """
+    num_nodes = tree.tree_sequence.num_nodes
+    parent = tree.parent_array
+    preorder = tree.preorder()
+    samples = tree.tree_sequence.samples()
+    is_sample = np.zeros(num_nodes, dtype=bool)
+    is_sample[samples] = True
+
+    # Depths and the numbers of samples below each node are found by moving
+    # every node up the tree in step, one NumPy operation per level of the
+    # tree rather than one Python step per node.
+    depth = np.zeros(num_nodes, dtype=np.int32)
+    u = preorder
+    ancestor = parent[u]
+    while u.size > 0:
+        keep = ancestor != tskit.NULL
+        u = u[keep]
+        ancestor = parent[ancestor[keep]]
+        depth[u] += 1
+    sample_count = is_sample.astype(np.int64)
+    ancestor = parent[samples]
+    while ancestor.size > 0:
+        ancestor = ancestor[ancestor != tskit.NULL]
+        np.add.at(sample_count, ancestor, 1)
+        ancestor = parent[ancestor]
+
+    # Each subtree is a contiguous run of the preorder, so the samples below
+    # any node form a contiguous slice of the samples listed in preorder.
+    sample_in_preorder = is_sample[preorder]
+    sample_flat = preorder[sample_in_preorder].astype(np.int64)
+    sample_offset = np.zeros(num_nodes, dtype=np.int64)
+    sample_offset[preorder] = np.cumsum(sample_in_preorder) - sample_in_preorder
+
+    # Group the non-root nodes by parent, keeping siblings in preorder.
+    child = preorder[parent[preorder] != tskit.NULL]
+    child = child[np.argsort(parent[child], kind="stable")]
+    internal, first_child = np.unique(parent[child], return_index=True)
+    last_child = np.append(first_child[1:], child.shape[0])
+    for u, start, stop in zip(internal, first_child, last_child):
+        children = child[start:stop]
+        # The samples below each child are followed directly by those below
+        # its later siblings, so each child is paired with all of them at once.
+        end = sample_offset[u] + sample_count[u]
+        for c1, c2 in zip(children, children[1:]):
+            s1 = sample_flat[sample_offset[c1] : sample_offset[c2]]
+            s2 = sample_flat[sample_offset[c2] : end]
+            a = np.minimum.outer(s1, s2).ravel()
+            b = np.maximum.outer(s1, s2).ravel()
+            pair_index = a * (a - 2 * k + 1) // -2 + b - a - 1
+            assert np.all(m_row[pair_index] == 1)
+            assert depth[u] <= np.iinfo(m_row.dtype).max
+            m_row[pair_index] = depth[u]
+
+
 def kc_distance(tree1, tree2):
     """
     Returns the Kendall-Colijn topological distance between the specified
@@ -43,27 +101,23 @@ def kc_distance(tree1, tree2):
         raise ValueError("Trees must have the same samples")
     k = samples.shape[0]
     n = (k * (k - 1)) // 2
-    M = [np.ones(n + k), np.ones(n + k)]
+    # Depths are small integers, so store them compactly and only convert
+    # to floating point for the final norm.
+    M = [np.ones(n + k, dtype=np.int16), np.ones(n + k, dtype=np.int16)]
     for tree_index, tree in enumerate([tree1, tree2]):
-        stack = [(tree.root, 0)]
-        while len(stack) > 0:
-            u, depth = stack.pop()
-            children = tree.children(u)
-            for v in children:
-                stack.append((v, depth + 1))
-            for c1, c2 in itertools.combinations(children, 2):
-                for u in tree.samples(c1):
-                    for v in tree.samples(c2):
-                        if u < v:
-                            a, b = u, v
-                        else:
-                            a, b = v, u
-                        pair_index = a * (a - 2 * k + 1) // -2 + b - a - 1
-                        assert M[tree_index][pair_index] == 1
-                        M[tree_index][pair_index] = depth
-    return np.linalg.norm(M[0] - M[1])
+        kc_fill(M[tree_index], tree, k)
+    return np.linalg.norm(M[0].astype(np.float64) - M[1].astype(np.float64))
 
 
+@functools.lru_cache(maxsize=None)
+def simulate(sample_size, recombination_rate=0, random_seed=1):
+    # Tree sequences are immutable, so it is safe to share them between tests.
+    return msprime.simulate(
+        sample_size, recombination_rate=recombination_rate, random_seed=random_seed
+    )
+
+
+@functools.lru_cache(maxsize=None)
 def get_nonbinary_example(sample_size=20, recombination_rate=0, random_seed=42):
     ts = msprime.simulate(
         sample_size=sample_size,
@@ -83,6 +137,27 @@ def get_nonbinary_example(sample_size=20, recombination_rate=0, random_seed=42):
     return ts
 
 
+class TestKCDistance:
+    """
+    Tests the reference kc_distance implementation against tskit.
+    """
+
+    def verify(self, ts1, ts2):
+        tree1 = ts1.first(sample_lists=True)
+        tree2 = ts2.first(sample_lists=True)
+        assert kc_distance(tree1, tree2) == pytest.approx(tree1.kc_distance(tree2))
+
+    def test_identical(self):
+        ts = simulate(10, random_seed=1)
+        self.verify(ts, ts)
+
+    def test_msprime_binary(self):
+        self.verify(simulate(10, random_seed=1), simulate(10, random_seed=2))
+
+    def test_msprime_non_binary(self):
+        self.verify(get_nonbinary_example(8), simulate(8, random_seed=3))
+
+
 class TestSingleTreeRoundTrip:
     """
     Tests that we can successfully roundtrip trees with various topologies
@@ -95,30 +170,22 @@ class TestSingleTreeRoundTrip:
         source_tree = ts.first()
         newick = tsconvert.to_newick(source_tree)
         conv_ts = tsconvert.from_newick(newick)
-
-        # Round tripping can introduce very slightly differing node times
-        # due to floating point manipulations, so round the times
-        conv_tables = conv_ts.dump_tables()
-        nodes = conv_tables.nodes.copy()
-        conv_tables.nodes.clear()
-        for node in nodes:
-            conv_tables.nodes.append(node.replace(time=round(node.time, 15)))
-        conv_tables.sort()
-        conv_ts = conv_tables.tree_sequence()
-
+        # The trees are compared structurally and the node times with a
+        # tolerance, so there is no need to round the converted times.
         assert conv_ts.num_trees == 1
-        conv_tree = conv_ts.first()
-        source_str = source_tree.draw(format="unicode", node_labels={}, order="tree")
-        conv_str = conv_tree.draw(format="unicode", node_labels={}, order="tree")
-        # The tree sequences are canonical, so the nodes are allocated in
-        # time order. We should be identical other than the leaf labels.
-        assert source_str == conv_str
+        # Newick leaf names are the source sample IDs plus one, so simplify
+        # to give the converted samples the same IDs as the source samples.
+        samples = sorted(
+            conv_ts.samples(), key=lambda u: int(conv_ts.node(u).metadata["name"])
+        )
+        conv_tree = conv_ts.simplify(samples).first()
+        assert kc_distance(source_tree, conv_tree) == 0
         assert np.allclose(
-            sorted(conv_ts.tables.nodes.time), sorted(ts.tables.nodes.time)
+            np.sort(conv_ts.nodes_time), np.sort(ts.nodes_time), rtol=0, atol=1e-9
         )
 
     def test_msprime_binary(self):
-        self.verify(msprime.simulate(10, random_seed=1))
+        self.verify(simulate(10, random_seed=1))
 
     def test_msprime_non_binary(self):
         self.verify(get_nonbinary_example(8))
@@ -136,19 +203,33 @@ class TestMsRoundTrip:
         for t1, t2 in zip(ts.trees(), new_ts.trees()):
             assert t1.interval[0] == pytest.approx(t2.interval[0])
             assert t1.interval[1] == pytest.approx(t2.interval[1])
-            assert kc_distance(t1, t2) == 0
+        assert ts.kc_distance(new_ts) == 0
 
     def test_msprime_single_tree(self):
-        self.verify(msprime.simulate(10, random_seed=12))
+        self.verify(simulate(10, random_seed=12))
 
     def test_msprime_binary(self):
-        self.verify(msprime.simulate(10, recombination_rate=1, random_seed=1))
+        self.verify(simulate(10, recombination_rate=1, random_seed=1))
 
     def test_msprime_non_binary(self):
         ts = get_nonbinary_example(8, recombination_rate=1)
         assert ts.num_trees > 1
         self.verify(ts)
 
+    def test_caterpillar_deeper_than_recursion_limit(self):
+        n = 2 * sys.getrecursionlimit()
+        tables = tskit.TableCollection(1)
+        for _ in range(n):
+            tables.nodes.add_row(flags=tskit.NODE_IS_SAMPLE, time=0)
+        child = 0
+        for j in range(1, n):
+            parent = tables.nodes.add_row(time=j)
+            tables.edges.add_row(0, 1, parent, child)
+            tables.edges.add_row(0, 1, parent, j)
+            child = parent
+        tables.sort()
+        self.verify(tables.tree_sequence())
+
     # TODO more examples
 
 
@@ -221,7 +302,52 @@ class TestFromMs:
         msout = """
         [5(1:0.27413282187548,2:0.27413282187548);
         """
-        with pytest.raises(dendropy.utility.error.DataParseError):
+        with pytest.raises(ValueError):
+            tsconvert.from_ms(msout)
+
+    @pytest.mark.parametrize(
+        "tree",
+        [
+            "(1:0.2,2:0.2",
+            "(1:0.2,2:0.2));",
+            "1:0.2,2:0.2);",
+            "(1:0.2,2:0.2]);",
+            "(1:0.2,2:0.2[);",
+            "(1:0.2,2:XXX);",
+            "(1:0.2,2:0.2:0.3);",
+            "(1:0.2,2:0.2)(3:0.1);",
+            "(1:0.2,2:0.2);(1:0.2,2:0.2)",
+            "(1:0.2,2:0.2)",
+        ],
+    )
+    def test_malformed_newick(self, tree):
+        with pytest.raises(ValueError):
+            tsconvert.from_ms(f"[1]{tree}")
+
+    @pytest.mark.parametrize(
+        "tree",
+        [
+            "(1:0.2,2:0.2);   ",
+            "(1:0.2,2:0.2)[comment];",
+            "(1:0.2,2:0.2);[comment]",
+            "(1:0.2,2:0.2); [comment]  ",
+        ],
+    )
+    def test_trailing_whitespace_and_comments(self, tree):
+        ts = tsconvert.from_ms(f"[1]{tree}\n")
+        assert ts.num_trees == 1
+        assert ts.num_samples == 2
+
+    @pytest.mark.parametrize("tree", ["(1:0.2,2:0.2)   ", "(1:0.2,2:0.2)[comment]"])
+    def test_trailing_whitespace_and_comments_no_semicolon(self, tree):
+        with pytest.raises(ValueError, match="missing ';'"):
+            tsconvert.from_ms(f"[1]{tree}\n")
+
+    def test_not_ultrametric(self):
+        msout = """
+        [1](1:0.2,2:0.3);
+        """
+        with pytest.raises(ValueError, match="not ultrametric"):
             tsconvert.from_ms(msout)
 
     def test_nonmatching_tips(self):
@@ -239,6 +365,13 @@ class TestFromMs:
         with pytest.raises(ValueError):
             tsconvert.from_ms(msout)
 
+        msout = """
+        [2](3:0.2144,(1:0.0768,2:0.0768):0.1376);
+        [4](2:0.2144,(1:0.0768,1:0.0768):0.1376);
+        """
+        with pytest.raises(ValueError, match="Tree 1 does not have all 3"):
+            tsconvert.from_ms(msout)
+
     def test_identical_node_times(self):
         msout = """
         [2](((1:1.5,2:1.5):1.7,3:3.2):1.1,(4:1.5,5:1.5):2.8);
@@ -369,6 +502,15 @@ class TestFromMs:
         assert tree.branch_length(0) == pytest.approx(2.06027985820196)
         assert tree.branch_length(1) == pytest.approx(2.06027985820196)
 
+    def test_no_simplify(self):
+        ts = simulate(10, recombination_rate=1, random_seed=1)
+        msout = tsconvert.to_ms(ts)
+        simplified_ts = tsconvert.from_ms(msout)
+        unsimplified_ts = tsconvert.from_ms(msout, simplify=False)
+        assert unsimplified_ts.num_trees == simplified_ts.num_trees
+        assert unsimplified_ts.num_edges > simplified_ts.num_edges
+        assert unsimplified_ts.kc_distance(simplified_ts) == 0
+
     def test_n4_example(self):
         # $ mspms 4 1 -T -r 4 10 -p 8
         msout = """
@@ -539,3 +681,90 @@ class TestNewicks:
     def test_bad_alternative_name(self, keyname):
         with pytest.raises(TypeError):
             tsconvert.from_newick("(2:0.10,3:0.20);", node_name_key=keyname)
+
+
+def to_argon(ts):
+    """
+    Returns the specified haploid tree sequence in ARGON's tree output format.
+    """
+    lines = []
+    for tree in ts.trees():
+        labels = {u: f"n_{u}" for u in tree.nodes()}
+        left, right = tree.interval
+        lines.append(
+            f"{tree.time(tree.root)}\t{int(left) + 1}\t{int(right)}\t"
+            f"{tree.newick(node_labels=labels)}"
+        )
+    return "\n".join(lines) + "\n"
+
+
+@functools.lru_cache(maxsize=None)
+def get_argon_example():
+    # ARGON simulates haploid samples on a discrete genome.
+    ts = msprime.sim_ancestry(
+        5,
+        sequence_length=50,
+        recombination_rate=0.05,
+        ploidy=1,
+        discrete_genome=True,
+        random_seed=1,
+    )
+    assert ts.num_trees > 1
+    return ts
+
+
+def sample_signatures(ts):
+    """
+    Returns a map from each sample to the times of its ancestors in every tree.
+    Internal node times are unique, so samples with the same signature can be
+    exchanged without changing any of the trees.
+    """
+    signatures = {u: [] for u in ts.samples()}
+    for tree in ts.trees():
+        for u in ts.samples():
+            path = []
+            v = tree.parent(u)
+            while v != tskit.NULL:
+                path.append(round(tree.time(v), 8))
+                v = tree.parent(v)
+            signatures[u].append(tuple(path))
+    return {u: tuple(signature) for u, signature in signatures.items()}
+
+
+class TestFromArgon:
+    def test_round_trip(self):
+        ts = get_argon_example()
+        new_ts = tsconvert.from_argon(to_argon(ts), ts.sequence_length)
+        assert new_ts.num_samples == ts.num_samples
+        assert new_ts.sequence_length == ts.sequence_length
+        assert new_ts.num_trees == ts.num_trees
+        for tree, new_tree in zip(ts.trees(), new_ts.trees()):
+            assert tree.interval == new_tree.interval
+            assert new_tree.total_branch_length == pytest.approx(
+                tree.total_branch_length
+            )
+        # ARGON labels are not kept, so match the converted samples to the
+        # source samples by their ancestry, and relabel them to compare the
+        # topologies.
+        signatures = sample_signatures(ts)
+        new_signatures = sample_signatures(new_ts)
+        assert sorted(signatures.values()) == sorted(new_signatures.values())
+        new_samples = {}
+        for u, signature in new_signatures.items():
+            new_samples.setdefault(signature, []).append(u)
+        samples = [new_samples[signature].pop() for signature in signatures.values()]
+        assert ts.kc_distance(new_ts.simplify(samples)) == 0
+
+    def test_no_simplify(self):
+        ts = get_argon_example()
+        argon = to_argon(ts)
+        simplified_ts = tsconvert.from_argon(argon, ts.sequence_length)
+        unsimplified_ts = tsconvert.from_argon(
+            argon, ts.sequence_length, simplify=False
+        )
+        assert unsimplified_ts.num_edges > simplified_ts.num_edges
+        assert unsimplified_ts.kc_distance(simplified_ts) == 0
+
+    def test_multiple_trees_on_line(self):
+        with pytest.raises(ValueError, match="single tree"):
+            tsconvert.from_argon("1\t1\t10\t(n_0:1,n_1:1);(n_0:1,n_1:1);\n", 10)
@@ -23,6 +23,7 @@
 #
 import discsim
 import ercs
+import numpy as np
 import tskit
 
 import tsconvert
@@ -34,7 +35,8 @@ class OrientedForestBaseTest:
         Verifies the specified oriented tree representation is equivalent to the
         specified tskit tree.
         """
-        assert sorted(tree.samples()) == list(range(n))
+        samples = np.fromiter(tree.samples(), dtype=np.int32)
+        assert np.array_equal(np.sort(samples), np.arange(n))
         for j in range(n):
             p1 = []
             u = j
@@ -113,8 +115,8 @@ class TestManyTrees(OrientedForestBaseTest):
     Tests that we can extract an oriented tree topology from a multi locus simulation.
     """
 
-    def verify(self, n, pi, tau):
-        ts = tsconvert.from_oriented_forest(n, pi, tau)
+    def verify(self, n, pi, tau, simplify=True):
+        ts = tsconvert.from_oriented_forest(n, pi, tau, simplify=simplify)
         assert len(tau) == len(pi)
         assert ts.sequence_length == len(pi)
         assert ts.num_samples == n
@@ -175,3 +177,22 @@ class TestManyTrees(OrientedForestBaseTest):
         pi, tau = sim.run(1)
         assert len(pi) == num_loci
         self.verify(10, pi, tau)
+
+    def test_ercs_n10_no_simplify(self):
+        sim = ercs.Simulator(10)
+        sim.sample = [None] + [(j, j) for j in range(10)]
+        sim.event_classes = [ercs.DiscEventClass(u=0.5, r=1)]
+        num_loci = 3
+        sim.recombination_probabilities = [0.1] * (num_loci - 1)
+        pi, tau = sim.run(1)
+        assert len(pi) == num_loci
+        self.verify(10, pi, tau, simplify=False)
+        simplified_ts = tsconvert.from_oriented_forest(10, pi, tau)
+        unsimplified_ts = tsconvert.from_oriented_forest(10, pi, tau, simplify=False)
+        # Without simplification every locus keeps all of its internal nodes,
+        # whether or not they are in that locus's tree.
+        num_internal = sum(len(p) - 10 - 1 for p in pi)
+        assert unsimplified_ts.num_nodes == 10 + num_internal
+        assert unsimplified_ts.num_nodes >= simplified_ts.num_nodes
+        assert unsimplified_ts.num_edges >= simplified_ts.num_edges
+        assert unsimplified_ts.kc_distance(simplified_ts) == 0
@@ -0,0 +1,75 @@
+#
+# MIT License
+#
+# Copyright (c) 2021 Tskit Developers
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+#
+import pathlib
+
+import pandas as pd
+
+import tsconvert
+
+DATA_DIR = pathlib.Path(__file__).parent / "data"
+
+
+class TestCsvToNodeMetadata:
+    def nextstrain_ts(self):
+        """
+        Returns the nextstrain tree, with a placeholder "country" on every node
+        that the metadata file should overwrite wherever it has a matching row.
+        """
+        with open(DATA_DIR / "nextstrain.nwk") as f:
+            ts = tsconvert.from_newick(f.read())
+        tables = ts.dump_tables()
+        schema = tables.nodes.metadata_schema
+        tables.nodes.packset_metadata(
+            [
+                schema.validate_and_encode_row({**node.metadata, "country": "Unknown"})
+                for node in ts.nodes()
+            ]
+        )
+        return tables.tree_sequence()
+
+    def test_nextstrain(self):
+        ts = self.nextstrain_ts()
+        df = pd.read_csv(DATA_DIR / "nextstrain.tsv", sep="\t").set_index("strain")
+        new_ts = tsconvert.csv_to_node_metadata(
+            ts, DATA_DIR / "nextstrain.tsv", "strain", "name", sep="\t"
+        )
+        assert new_ts.num_nodes == ts.num_nodes
+        assert new_ts.tables.nodes.time.tolist() == ts.tables.nodes.time.tolist()
+        num_matched = 0
+        for node, new_node in zip(ts.nodes(), new_ts.nodes()):
+            name = node.metadata["name"]
+            if name in df.index:
+                # Matched rows are merged in, overwriting clashing keys
+                num_matched += 1
+                row = df.loc[name]
+                assert new_node.metadata["name"] == name
+                assert new_node.metadata["strain"] == name
+                assert new_node.metadata["country"] == row["country"]
+                assert new_node.metadata["country"] != "Unknown"
+                assert new_node.metadata["length"] == row["length"]
+                assert set(new_node.metadata) == {"name", "strain"} | set(df.columns)
+            else:
+                # Unmatched rows are unchanged
+                assert new_node.metadata == node.metadata
+        assert 0 < num_matched < ts.num_nodes
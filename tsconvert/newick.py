@@ -21,95 +21,273 @@
 # OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
 # SOFTWARE.
 #
-import dendropy
+import re
+
 import newick
+import numpy as np
 import tskit
 
 
-def from_ms(string) -> tskit.TreeSequence:
+# Tokens in a newick string are punctuation, or labels and numbers (anything
+# else up to the next delimiter). Whitespace and bracketed comments are
+# consumed by the regex engine and never reach the parser, so only unbalanced
+# comment brackets are returned as stray tokens. Trailing whitespace and
+# comments match as an empty token at the end of the string, so the engine
+# never backtracks into them and findall never rescans them.
+_NEWICK_TOKEN_RE = re.compile(r"(?:\s+|\[[^\]]*\])*([(),:;]|[^(),:;\[\]\s]+|[\[\]]|$)")
+
+
+def _newick_tokens(string, pos, endpos):
     """
-    Returns a tree sequence representation of the specified ms formatted tree output.
+    Returns the list of tokens in ``string[pos:endpos]``.
+    """
+    tokens = _NEWICK_TOKEN_RE.findall(string, pos, endpos)
+    while len(tokens) > 0 and tokens[-1] == "":
+        tokens.pop()
+    return tokens
+
+
+# The first contiguous block of lines starting with "[" holds the ms trees.
+_MS_TREE_BLOCK_RE = re.compile(r"(?:^[^\S\n]*\[.*(?:\n|\Z))+", re.MULTILINE)
+# Each tree is preceded by the number of positions it spans, in square braces.
+_MS_SPAN_RE = re.compile(r"\s*\[([^\]]*)\]")
+
+
+def _parse_tokens(tokens):
     """
-    recording_trees = False
-    tree_lines = ""
-    for line in string.splitlines():
-        line = line.strip()
-        if line.startswith("["):
-            recording_trees = True
-            tree_lines += line
+    Parses a single newick tree in one pass over its tokens, returning the
+    parent index, branch length and label of each node. Parents and branch
+    lengths are numpy arrays and labels are a list. Nodes are numbered in
+    preorder, so the root is node 0 and every node appears after its parent.
+    Missing lengths are NaN, missing labels are ``None`` and comments are
+    ignored.
+    """
+    parent = []
+    length = []
+    label = []
+
+    def add_node(p):
+        parent.append(p)
+        length.append(None)
+        label.append(None)
+        return len(parent) - 1
+
+    stack = []
+    current = add_node(-1)
+    # Whether we have moved past the point where a node's children can start
+    closed = False
+    expect_length = False
+    finished = False
+    for token in tokens:
+        if finished:
+            raise ValueError(f"Malformed newick: unexpected {token!r} after ';'")
+        if expect_length:
+            # Lengths are kept as strings and converted together at the end
+            length[current] = token
+            expect_length = False
+        elif token == "(":
+            if closed:
+                raise ValueError("Malformed newick: unexpected '('")
+            stack.append(current)
+            current = add_node(current)
+        elif token == ",":
+            if len(stack) == 0:
+                raise ValueError("Malformed newick: ',' outside of parentheses")
+            current = add_node(stack[-1])
+            closed = False
+        elif token == ")":
+            if len(stack) == 0:
+                raise ValueError("Malformed newick: unbalanced ')'")
+            current = stack.pop()
+            closed = True
+        elif token == ":":
+            if length[current] is not None:
+                raise ValueError("Malformed newick: repeated branch length")
+            expect_length = True
+            closed = True
+        elif token == ";":
+            finished = True
+        elif token in "[]":
+            raise ValueError("Malformed newick: unbalanced comment brackets")
         else:
-            if recording_trees:
-                break  # stop after the first non-tree line
+            if label[current] is not None or length[current] is not None:
+                raise ValueError(f"Malformed newick: unexpected label {token!r}")
+            label[current] = token
+            closed = True
+    if expect_length:
+        raise ValueError("Malformed newick: missing branch length")
+    if len(stack) > 0:
+        raise ValueError("Malformed newick: unbalanced '('")
+    if not finished:
+        raise ValueError("Malformed newick: missing ';'")
+    try:
+        length = np.array(length, dtype=np.float64)
+    except ValueError as e:
+        raise ValueError(f"Malformed newick: bad branch length ({e})")
+    return np.array(parent, dtype=np.int32), length, label
+
+
+def _node_ages(parent, length):
+    """
+    Returns the age of each node in a parsed newick tree, given the numpy
+    arrays of preorder parent indexes and branch lengths. Leaves have age zero
+    and each internal node is dated by its first child, with the other
+    children required to agree to within a small tolerance.
+    """
+    num_nodes = parent.shape[0]
+    index = np.arange(num_nodes)
+    is_leaf = np.ones(num_nodes, dtype=bool)
+    is_leaf[parent[1:]] = False
+    # In preorder a node's first child immediately follows it, so the chain of
+    # first children from any node down to a leaf is a contiguous run of
+    # indexes. The number of steps down this chain gives the order in which
+    # ages can be computed, one vectorised level at a time.
+    leaves = np.flatnonzero(is_leaf)
+    height = leaves[np.searchsorted(leaves, index)] - index
+    order = np.argsort(height, kind="stable")
+    bounds = np.searchsorted(height[order], np.arange(height.max() + 2))
+    ages = np.zeros(num_nodes)
+    for level in range(1, height.max() + 1):
+        u = order[bounds[level] : bounds[level + 1]]
+        ages[u] = ages[u + 1] + length[u + 1]
+    # Every other child must agree with the first
+    v = index[1:][parent[1:] != index[1:] - 1]
+    if np.any(np.abs(ages[parent[v]] - (ages[v] + length[v])) > 1e-5):
+        raise ValueError("Tree is not ultrametric within threshold of 1e-05")
+    return ages
+
 
-    if tree_lines == "":
+def from_ms(string, *, simplify=True) -> tskit.TreeSequence:
+    """
+    Returns a tree sequence representation of the specified ms formatted tree output.
+
+    :param str string: The ms output, as produced with the ``-T`` flag.
+    :param bool simplify: If True (the default), simplify the result so that
+        edges shared by adjacent trees are merged. If False, each tree keeps
+        its own copy of every edge, and internal nodes are numbered in the
+        order their times first appear in the ms output.
+    :return: A tree sequence with one tree for each tree in the ms output.
+    """
+    match = _MS_TREE_BLOCK_RE.search(string)
+    if match is None:
         raise ValueError(
             "Malformed input: no lines starting with [."
             " Make sure you run ms with the -T and -r flags."
         )
 
-    trees = dendropy.TreeList.get(
-        data=tree_lines,
-        schema="newick",
-        extract_comment_metadata=True,
-        rooting="force-rooted",
-    )
-
-    if len(trees) == 0:
-        raise ValueError("No valid trees in ms file")
-
+    # Walk the block with a cursor, reading the span of each tree and then
+    # parsing the tree in place, up to and including its ";".
+    block = match.group()
     spans = []
-    for i, tree in enumerate(trees):
+    trees = []
+    pos = 0
+    while pos < len(block):
+        end = block.find(";", pos) + 1
+        if end == 0:
+            end = len(block)
+        # The span is a comment as far as the tokenizer is concerned, so the
+        # tokens of the whole segment are those of the tree. Skip anything
+        # between trees that is only whitespace and comments.
+        tokens = _newick_tokens(block, pos, end)
+        if tokens in ([], [";"]):
+            pos = end
+            continue
+        span_match = _MS_SPAN_RE.match(block, pos, end)
         try:
-            spans.append(
-                float(tree.comments[0])
-            )  # the initial [X] is the first comment
-        except (ValueError, IndexError):
+            if span_match is None:
+                raise ValueError()
+            spans.append(float(span_match.group(1)))
+        except ValueError:
             raise ValueError(
-                f"Problem reading integer # of positions spanned in tree {i}"
+                f"Problem reading integer # of positions spanned in tree {len(trees)}"
                 + " (in ms format this preceeds the tree, in square braces)"
             )
-        if len(trees.taxon_namespace) != sum(1 for _ in tree.leaf_node_iter()):
+        trees.append(_parse_tokens(tokens))
+        pos = end
+    if len(trees) == 0:
+        raise ValueError("No valid trees in ms file")
+
+    # Validate the trees and compute their node ages in a single pass. Every
+    # tree must have the same set of labelled tips as the first.
+    tip_labels = None
+    tree_is_leaf = []
+    tree_ages = []
+    sorted_internal_ages = []
+    for i, (parent, length, label) in enumerate(trees):
+        is_leaf = np.ones(len(parent), dtype=bool)
+        is_leaf[parent[1:]] = False
+        leaves = np.flatnonzero(is_leaf)
+        leaf_labels = {label[u] for u in leaves}
+        if tip_labels is None:
+            tip_labels = leaf_labels - {None}
+        if len(leaves) != len(tip_labels) or leaf_labels != tip_labels:
             raise ValueError(
-                "Tree {} does not have all {} expected tips".format(
-                    i, len(trees.taxon_namespace)
-                )
+                "Tree {} does not have all {} expected tips".format(i, len(tip_labels))
             )
-        # below we might want to set is_force_max_age=True to allow ancient tips
-        # and work around branch length precision errors in ms
-        tree.calc_node_ages()
-        node_ages = [n.age for n in tree.ageorder_node_iter(include_leaves=False)]
-        if len(set(node_ages)) != len(node_ages):
+        # Missing branch lengths are treated as zero
+        length[np.isnan(length)] = 0
+        ages = _node_ages(parent, length)
+        # Sort the internal ages once, both to find repeated times and to
+        # allocate node IDs below.
+        node_ages = np.sort(ages[~is_leaf])
+        if np.any(node_ages[1:] == node_ages[:-1]):
             raise ValueError(
                 f"Tree {i}: cannot have two internal nodes with the same time"
             )
+        tree_is_leaf.append(is_leaf)
+        tree_ages.append(ages)
+        sorted_internal_ages.append(node_ages)
 
     # NB: here we could check that the sequence_length == nsites, where nsites is given
     # in the ms_line, as the second number following the -r switch
 
+    # Build the node and edge columns up front and hand them to the tables
+    # in one go. The samples come first, followed by a node for each distinct
+    # internal node age, in order of first appearance when the trees are
+    # visited in turn with their internal nodes in time order.
+    num_samples = len(tip_labels)
+    all_ages = np.concatenate(sorted_internal_ages)
+    unique_ages, first_seen = np.unique(all_ages, return_index=True)
+    appearance_order = np.argsort(first_seen)
+    age_id = np.empty(unique_ages.shape[0], dtype=np.int32)
+    age_id[appearance_order] = num_samples + np.arange(unique_ages.shape[0])
+    node_time = np.concatenate([np.zeros(num_samples), unique_ages[appearance_order]])
+
+    # The number of edges in each tree is known, so the edge columns can be
+    # allocated once and filled in place.
+    num_edges = np.array([len(parent) - 1 for parent, _, _ in trees])
+    breakpoints = np.concatenate([[0], np.cumsum(spans)])
+    edge_left = np.repeat(breakpoints[:-1], num_edges)
+    edge_right = np.repeat(breakpoints[1:], num_edges)
+    edge_parent = np.empty(np.sum(num_edges), dtype=np.int32)
+    edge_child = np.empty(np.sum(num_edges), dtype=np.int32)
+    # Tips are labelled with their sample ID plus one, and every tree has the
+    # same tips, so each label only needs to be converted once.
+    tip_id = {label: int(label) - 1 for label in tip_labels}
+    offset = 0
+    for (parent, _, label), is_leaf, ages in zip(trees, tree_is_leaf, tree_ages):
+        node_id = np.zeros(len(parent), dtype=np.int32)
+        leaves = np.flatnonzero(is_leaf)
+        node_id[leaves] = [tip_id[label[u]] for u in leaves]
+        internal = np.flatnonzero(~is_leaf)
+        node_id[internal] = age_id[np.searchsorted(unique_ages, ages[internal])]
+        # Every node other than the root is the child of one edge
+        end = offset + len(parent) - 1
+        edge_parent[offset:end] = node_id[parent[1:]]
+        edge_child[offset:end] = node_id[1:]
+        offset = end
+
     tables = tskit.TableCollection(sum(spans))
-    # Get the samples from the first tree.
-    for node in trees[0].leaf_node_iter():
-        tables.nodes.add_row(flags=tskit.NODE_IS_SAMPLE, time=node.age)
-
-    age_id_map = {}
-    left = 0
-    for span, tree in zip(spans, trees):
-        right = left + span
-        for node in tree.ageorder_node_iter(include_leaves=False):
-            children = list(node.child_nodes())
-            if node.age not in age_id_map:
-                age_id_map[node.age] = tables.nodes.add_row(flags=0, time=node.age)
-            parent_id = age_id_map[node.age]
-            for child in children:
-                if child.is_leaf():
-                    child_id = int(child.taxon.label) - 1
-                else:
-                    child_id = age_id_map[child.age]
-                tables.edges.add_row(left, right, parent_id, child_id)
-        left = right
+    flags = np.zeros(len(node_time), dtype=np.uint32)
+    flags[:num_samples] = tskit.NODE_IS_SAMPLE
+    tables.nodes.set_columns(flags=flags, time=node_time)
+    tables.edges.set_columns(
+        left=edge_left, right=edge_right, parent=edge_parent, child=edge_child
+    )
     tables.sort()
-    # Simplify will squash together any edges, removing redundancy.
-    tables.simplify()
+    if simplify:
+        # Simplify will squash together any edges, removing redundancy.
+        tables.simplify()
     return tables.tree_sequence()
 
 
@@ -117,11 +295,11 @@ def to_ms(ts) -> str:
     """
     Returns an ms-formatted version of the specified tree sequence.
     """
-    output = ""
+    output = []
     for tree in ts.trees():
         span = tree.interval[1] - tree.interval[0]
-        output += f"[{span}]{tree.newick()}\n"
-    return output
+        output.append(f"[{span}]{tree.newick()}\n")
+    return "".join(output)
 
 
 def from_newick(
@@ -161,8 +339,7 @@ def from_newick(
         tables.time_units = time_units
     if node_name_key is None:
         node_name_key = "name"
-    nodes = tables.nodes
-    nodes.metadata_schema = tskit.MetadataSchema(
+    tables.nodes.metadata_schema = tskit.MetadataSchema(
         {
             "codec": "json",
             "type": "object",
@@ -178,26 +355,35 @@ def from_newick(
             },
         }
     )
+    encode_metadata = tables.nodes.metadata_schema.validate_and_encode_row
 
-    id_map = {}
+    # The node and edge columns are accumulated here and passed to the tables
+    # in one go at the end.
+    node_flags = []
+    node_time = []
+    node_metadata = []
+    edge_parent = []
+    edge_child = []
 
-    def get_or_add_node(newick_node, time):
-        if newick_node not in id_map:
-            flags = tskit.NODE_IS_SAMPLE if len(newick_node.descendants) == 0 else 0
-            metadata = {}
-            if newick_node.name:
-                metadata[node_name_key] = newick_node.name
-            if newick_node.comment:
-                metadata["comment"] = newick_node.comment
-            id_map[newick_node] = tables.nodes.add_row(
-                flags=flags, time=time, metadata=metadata
-            )
-        return id_map[newick_node]
+    def add_node(newick_node, time):
+        flags = tskit.NODE_IS_SAMPLE if len(newick_node.descendants) == 0 else 0
+        metadata = {}
+        if newick_node.name:
+            metadata[node_name_key] = newick_node.name
+        if newick_node.comment:
+            metadata["comment"] = newick_node.comment
+        node_flags.append(flags)
+        node_time.append(time)
+        node_metadata.append(encode_metadata(metadata))
+        return len(node_time) - 1
 
-    root = next(tree.walk())
-    get_or_add_node(root, 0)
-    for newick_node in tree.walk():
-        node_id = id_map[newick_node]
+    root = tree
+    # Visit the newick nodes in preorder, carrying the tskit ID allocated to
+    # each one when its parent was visited.
+    stack = [(root, add_node(root, 0))]
+    while len(stack) > 0:
+        newick_node, node_id = stack.pop()
+        children = []
         for child in newick_node.descendants:
             length = max(child.length, min_edge_length)
             if length <= 0:
@@ -206,51 +392,96 @@ def from_newick(
                     " <= 0. Set min_edge_length to force lengths to a"
                     " minimum size"
                 )
-            child_node_id = get_or_add_node(child, nodes[node_id].time - length)
-            tables.edges.add_row(0, span, node_id, child_node_id)
+            child_node_id = add_node(child, node_time[node_id] - length)
+            edge_parent.append(node_id)
+            edge_child.append(child_node_id)
+            children.append((child, child_node_id))
+        stack.extend(reversed(children))
     # Rewrite node times to fit the tskit convention of zero at the youngest leaf
-    nodes = tables.nodes.copy()
-    youngest = min(tables.nodes.time)
-    tables.nodes.clear()
-    for node in nodes:
-        tables.nodes.append(node.replace(time=node.time - youngest + root.length))
+    time = np.array(node_time)
+    metadata, metadata_offset = tskit.pack_bytes(node_metadata)
+    tables.nodes.set_columns(
+        flags=np.array(node_flags, dtype=np.uint32),
+        time=time - time.min() + root.length,
+        metadata=metadata,
+        metadata_offset=metadata_offset,
+    )
+    num_edges = len(edge_child)
+    tables.edges.set_columns(
+        left=np.zeros(num_edges),
+        right=np.full(num_edges, span, dtype=np.float64),
+        parent=np.array(edge_parent, dtype=np.int32),
+        child=np.array(edge_child, dtype=np.int32),
+    )
     tables.sort()
     return tables.tree_sequence()
 
 
-def get_dendropy_node_id(node) -> int:
+def _get_dendropy_node_label(node) -> str:
     """
-    From a DendroPy Node object, returns the ID of that node.
+    From a DendroPy Node object, returns the label holding the ID of that node.
     """
     if node._label is None:
-        return int(node.taxon._label.split()[1])
+        return node.taxon._label
     else:
-        return int(node._label.split()[1])
+        return node._label
+
+
+def get_dendropy_node_id(node) -> int:
+    """
+    From a DendroPy Node object, returns the ID of that node.
+    """
+    return int(_get_dendropy_node_label(node).split()[1])
 
 
-def from_argon(string, sequence_length) -> tskit.TreeSequence:
+def from_argon(string, sequence_length, *, simplify=True) -> tskit.TreeSequence:
     """
     Returns a tree sequence representation of an ARGON .trees file.
     (Does not include mutations!)
+
+    :param str string: The contents of the ARGON .trees file.
+    :param float sequence_length: The sequence length of the tree sequence.
+    :param bool simplify: If True (the default), simplify the result so that
+        edges shared by adjacent trees are merged and node IDs are compacted.
+        If False, the nodes and edges are returned as read from each tree.
+    :return: A tree sequence with one tree for each line of the ARGON file.
     """
-    string_by_lines = string.splitlines()
-    tables = tskit.TableCollection(sequence_length)
-    id_map = {}
+    import dendropy
 
     # Each line corresponds to a tree.
-    for line in string_by_lines:
-        argon_tree = line.split("\t")
+    argon_trees = [line.split("\t") for line in string.splitlines()]
+    # Read all the trees with a single newick reader, rather than setting up
+    # a new reader for every line.
+    trees = dendropy.TreeList.get(
+        data="\n".join(argon_tree[3] for argon_tree in argon_trees), schema="newick"
+    )
+    if len(trees) != len(argon_trees):
+        raise ValueError("Each line of an ARGON file must contain a single tree")
+    id_map = {}
+    # The same labels recur in every tree, so only parse each one once.
+    label_ids = {}
+    node_flags = []
+    node_time = []
+    edge_left = []
+    edge_right = []
+    edge_parent = []
+    edge_child = []
+
+    for argon_tree, tree in zip(argon_trees, trees):
         # unused tmrca = argon_tree[0]
         left = float(argon_tree[1]) - 1
         right = float(argon_tree[2])
 
-        # Read in the tree.
-        tree = dendropy.Tree.get(data=argon_tree[3], schema="newick")
-
         # Make the tables.
+        argon_ids = {}
         for node in tree.ageorder_node_iter():
             time = node.age
-            node_id_argon = get_dendropy_node_id(node)
+            label = _get_dendropy_node_label(node)
+            node_id_argon = label_ids.get(label)
+            if node_id_argon is None:
+                node_id_argon = int(label.split()[1])
+                label_ids[label] = node_id_argon
+            argon_ids[node] = node_id_argon
             children = list(node.child_nodes())
             # The keys of id_map need to include the time of the node,
             # because, annoyingly, ARGON sometimes gives the same
@@ -258,22 +489,41 @@ def from_argon(string, sequence_length) -> tskit.TreeSequence:
             if (node_id_argon, time) not in id_map:
                 flags = tskit.NODE_IS_SAMPLE if len(children) == 0 else 0
                 # TODO derive information from the node and store it as JSON metadata.
-                id_map[(node_id_argon, time)] = tables.nodes.add_row(
-                    flags=flags, time=time
-                )
+                id_map[(node_id_argon, time)] = len(node_time)
+                node_flags.append(flags)
+                node_time.append(time)
             node_id = id_map[(node_id_argon, time)]
             for child in children:
-                tables.edges.add_row(
-                    left,
-                    right,
-                    node_id,
-                    id_map[(get_dendropy_node_id(child), child.age)],
-                )
+                edge_left.append(left)
+                edge_right.append(right)
+                edge_parent.append(node_id)
+                edge_child.append(id_map[(argon_ids[child], child.age)])
 
+    tables = tskit.TableCollection(sequence_length)
+    tables.nodes.set_columns(
+        flags=np.array(node_flags, dtype=np.uint32),
+        time=np.array(node_time, dtype=np.float64),
+    )
+    tables.edges.set_columns(
+        left=np.array(edge_left, dtype=np.float64),
+        right=np.array(edge_right, dtype=np.float64),
+        parent=np.array(edge_parent, dtype=np.int32),
+        child=np.array(edge_child, dtype=np.int32),
+    )
     tables.sort()
-    return tables.tree_sequence().simplify()
+    if simplify:
+        tables.simplify()
+    return tables.tree_sequence()
 
 
 def to_newick(tree, precision=16) -> str:
-    # TODO implement a clean python version here.
+    """
+    Returns a newick representation of the specified tree, in which leaves are
+    labelled with their node ID plus one, as in ms output. The string is built
+    by tskit's C newick writer, which walks the tree arrays directly.
+
+    :param tskit.Tree tree: The tree to convert.
+    :param int precision: The number of decimal places used for branch lengths.
+    :return: A newick string.
+    """
     return tree.newick(precision=precision)
@@ -25,10 +25,11 @@
 Converts trees specified in Oriented forest form to tskit. This is the output
 produced by the discsim and ercs simulators.
 """
+import numpy as np
 import tskit
 
 
-def from_oriented_forest(n, pi, tau):
+def from_oriented_forest(n, pi, tau, *, simplify=True):
     """
     Returns a tree sequence from the specified oriented forest definition.
     Oriented forests are returned by the
@@ -49,25 +50,49 @@ def from_oriented_forest(n, pi, tau):
     :param list(list) pi: The list of per-locus tree topologies as a parent
         array.
     :param list(list) tau: The list of per-locus node times.
+    :param bool simplify: If True (the default), simplify the result so that
+        edges shared by adjacent loci are merged. If False, every locus has
+        its own edges and its own copy of each internal node, including any
+        internal nodes that are not in that locus's tree.
     :rtype: tskit.TreeSquence
     :return: A TreeSequence object with the same topologies as the specified
         oriented forest.
     """
     L = len(pi)
-    tables = tskit.TableCollection(L)
-    # Allocate the samples
-    for j in range(n):
-        tables.nodes.add_row(time=tau[0][j + 1], flags=tskit.NODE_IS_SAMPLE)
-    # We could do better here by mapping by node time, but we cannot assume that
-    # node times are unique as discsim and ercs can have multiple nodes occuring
-    # at the same time.
+    # The samples come first, followed by the internal nodes of each locus in
+    # turn. We could do better here by mapping by node time, but we cannot
+    # assume that node times are unique as discsim and ercs can have multiple
+    # nodes occuring at the same time.
+    node_time = [np.asarray(tau[0][1 : n + 1], dtype=np.float64)]
+    num_nodes = n
+    edge_left = []
+    edge_parent = []
+    edge_child = []
     for i in range(L):
-        node_map = {j + 1: j for j in range(n)}
-        for j in range(n + 1, len(pi[i])):
-            node_map[j] = tables.nodes.add_row(time=tau[i][j], flags=0)
-        for j in range(1, len(pi[i])):
-            if pi[i][j] != 0:
-                tables.edges.add_row(i, i + 1, node_map[pi[i][j]], node_map[j])
+        parent = np.asarray(pi[i], dtype=np.int32)
+        num_internal = len(parent) - n - 1
+        # Map oriented forest node j to its tskit ID by indexing directly.
+        node_map = np.full(len(parent), -1, dtype=np.int32)
+        node_map[1 : n + 1] = np.arange(n)
+        node_map[n + 1 :] = num_nodes + np.arange(num_internal)
+        node_time.append(np.asarray(tau[i][n + 1 :], dtype=np.float64))
+        num_nodes += num_internal
+        child = np.flatnonzero(parent[1:] != 0) + 1
+        edge_left.append(np.full(len(child), i, dtype=np.float64))
+        edge_parent.append(node_map[parent[child]])
+        edge_child.append(node_map[child])
+    tables = tskit.TableCollection(L)
+    flags = np.zeros(num_nodes, dtype=np.uint32)
+    flags[:n] = tskit.NODE_IS_SAMPLE
+    tables.nodes.set_columns(flags=flags, time=np.concatenate(node_time))
+    left = np.concatenate(edge_left)
+    tables.edges.set_columns(
+        left=left,
+        right=left + 1,
+        parent=np.concatenate(edge_parent),
+        child=np.concatenate(edge_child),
+    )
     tables.sort()
-    tables.simplify()
+    if simplify:
+        tables.simplify()
     return tables.tree_sequence()
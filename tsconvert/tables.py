@@ -21,7 +21,7 @@
 # OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
 # SOFTWARE.
 #
-import pandas as pd
+import tskit
 
 
 def pandas_to_table_metadata(table, dataframe, index_metadata_property):
@@ -36,20 +36,20 @@ def pandas_to_table_metadata(table, dataframe, index_metadata_property):
         dataframe index.
     """
 
-    row_for_id = {
-        index: row for index, row in zip(dataframe.index, dataframe.to_dict("records"))
-    }
-    table_copy = table.copy()
-    table.clear()
-    for row in table_copy:
-        table.append(
-            row.replace(
-                metadata={
-                    **row.metadata,
-                    **row_for_id.get(row.metadata[index_metadata_property], {}),
-                }
-            )
-        )
+    # Keep the dataframe as columns of native Python values and only build a
+    # dict for the rows that are matched, rather than one for every row.
+    columns = {name: dataframe[name].tolist() for name in dataframe.columns}
+    position = {index: j for j, index in enumerate(dataframe.index)}
+    # Rewrite the metadata column in one go, rather than re-appending every row.
+    schema = table.metadata_schema
+    encoded = []
+    for metadata in tskit.unpack_bytes(table.metadata, table.metadata_offset):
+        metadata = schema.decode_row(metadata)
+        j = position.get(metadata[index_metadata_property])
+        if j is not None:
+            metadata.update({name: col[j] for name, col in columns.items()})
+        encoded.append(schema.validate_and_encode_row(metadata))
+    table.packset_metadata(encoded)
 
 
 def csv_to_node_metadata(ts, file_or_path, id_col, id_metadata_property, **kwargs):
@@ -70,6 +70,7 @@ def csv_to_node_metadata(ts, file_or_path, id_col, id_metadata_property, **kwarg
     :param string id_metadata_property: Name of the metadata property in the tree
         sequence to match to the CSV.
     """
+    import pandas as pd
 
     df = pd.read_csv(file_or_path, **kwargs)
     df = df.set_index(id_col, drop=False)